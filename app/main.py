@@ -1,13 +1,14 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import logging
 import os
 from contextlib import asynccontextmanager
 
-from .models.database import create_tables
+from .models.database import create_tables, engine
 from .routers import images, auth
+from .services import search_index
 from .utils.helpers import setup_logging, ensure_directory_exists
 
 # Setup logging
@@ -20,7 +21,7 @@ async def lifespan(app: FastAPI):
     logger.info("Starting up AI Image Captioning API...")
     
     # Create tables
-    create_tables()
+    await create_tables()
     logger.info("Database tables created/verified")
     
     # Ensure upload directory exists
@@ -35,6 +36,13 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down AI Image Captioning API...")
+    
+    # Persist the ANN index so the next start skips rebuilding it
+    if search_index.search_index is not None:
+        search_index.search_index.save()
+    
+    # Close pooled connections so SQLite runs PRAGMA optimize
+    await engine.dispose()
 
 app = FastAPI(
     title="AI-Powered Image Captioning and Search API",
@@ -47,6 +55,7 @@ app = FastAPI(
     - **Secure Authentication**: JWT-based user authentication
     """,
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -71,7 +80,7 @@ app.include_router(images.router)
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Global exception handler caught: {str(exc)}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "Internal server error occurred"}
     )
@@ -92,3 +101,8 @@ async def root():
             "Comprehensive documentation"
         ]
     }
+
+@app.get("/health", tags=["root"])
+async def health():
+    """Liveness check for the Streamlit client and container healthchecks"""
+    return {"status": "healthy"}
@@ -1,15 +1,82 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, LargeBinary
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import event, insert, inspect, Index, Column, Integer, String, Text, DateTime
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from datetime import datetime
+from typing import List
 import os
+import logging
 from dotenv import load_dotenv
 
+from .migrations import run_migrations, set_schema_version, SCHEMA_VERSION
+
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./images.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "1000"))
+
+def to_async_url(url: str) -> str:
+    """Point plain sqlite:// and postgresql:// URLs from existing .env files at their asyncio drivers"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+def engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and (
+        parsed.database in (None, "", ":memory:") or parsed.query.get("mode") == "memory"
+    ):
+        # An in-memory database lives and dies with its single connection
+        return {"poolclass": StaticPool}
+    # aiosqlite would otherwise default to NullPool and reconnect (and re-run PRAGMAs) per request
+    return {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# WAL lets searches read while an upload writes; NORMAL sync is durable under WAL
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "cache_size=-65536",  # 64MB page cache
+    "temp_store=MEMORY",
+    "mmap_size=268435456",  # 256MB
+    "busy_timeout=60000",
+)
+
+engine = create_async_engine(to_async_url(DATABASE_URL), **engine_options(DATABASE_URL))
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+    
+    @event.listens_for(engine.sync_engine, "close")
+    def _optimize_sqlite(dbapi_conn, connection_record):
+        # Refreshes planner statistics only for tables whose shape changed
+        try:
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA optimize")
+            cursor.close()
+        except Exception as e:
+            logger.warning(f"PRAGMA optimize failed: {str(e)}")
+
+AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
 
 Base = declarative_base()
 
@@ -19,11 +86,17 @@ class ImageRecord(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, unique=True, index=True)
     caption = Column(Text)
-    embedding = Column(LargeBinary)  # Store as binary
+    embedding_offset = Column(Integer)  # Row of this image's vector in the embedding store
     upload_time = Column(DateTime, default=datetime.utcnow)
     file_path = Column(String)
     file_size = Column(Integer)
     content_type = Column(String)
+    sha256 = Column(String, unique=True, index=True)  # Hex digest of the file, used to dedupe uploads
+    
+    __table_args__ = (
+        # Serves the newest-first ORDER BY in /images/history without a sort
+        Index("ix_images_upload_time", upload_time.desc()),
+    )
 
 class User(Base):
     __tablename__ = "users"
@@ -34,12 +107,38 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Integer, default=1)
 
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+def _create_tables(conn: Connection) -> None:
+    is_new_database = not inspect(conn).has_table(ImageRecord.__tablename__)
+    Base.metadata.create_all(bind=conn)
+    if is_new_database and conn.dialect.name == "sqlite":
+        # Fresh schema is already current, nothing to migrate
+        set_schema_version(conn, SCHEMA_VERSION)
+    else:
+        run_migrations(conn)
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("ANALYZE")
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(_create_tables)
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def insert_image_records(db: AsyncSession, records: List[dict]) -> List:
+    """Insert image rows as one executemany per batch, committing every INSERT_BATCH_SIZE rows.
+
+    Returns (id, upload_time) rows in the same order as `records`.
+    """
+    rows = []
+    for start in range(0, len(records), INSERT_BATCH_SIZE):
+        result = await db.execute(
+            insert(ImageRecord).returning(
+                ImageRecord.id, ImageRecord.upload_time, sort_by_parameter_order=True
+            ),
+            records[start:start + INSERT_BATCH_SIZE]
+        )
+        rows.extend(result.all())
+        await db.commit()
+    return rows
@@ -0,0 +1,124 @@
+import logging
+import os
+import pickle
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from ..services.embedding_store import get_embedding_store, EmbeddingStore, EMBEDDING_DIM
+
+logger = logging.getLogger(__name__)
+
+# Where migration 4 writes the float32 sidecar file; migration 6 quantizes it into the store
+LEGACY_EMBEDDINGS_PATH = os.getenv("LEGACY_EMBEDDINGS_PATH", "embeddings.f32")
+
+def _legacy_embeddings_path() -> str:
+    """The float32 file, which must never be the int8 store itself"""
+    store_path = get_embedding_store().path
+    if os.path.abspath(store_path) == os.path.abspath(LEGACY_EMBEDDINGS_PATH):
+        raise RuntimeError(
+            f"EMBEDDINGS_PATH and LEGACY_EMBEDDINGS_PATH both point at {store_path}; "
+            f"set EMBEDDINGS_PATH to a new file for the int8 store"
+        )
+    return LEGACY_EMBEDDINGS_PATH
+
+def _embeddings_pickle_to_float32(conn: Connection) -> None:
+    """Rewrite pickled numpy embeddings as raw float32 bytes"""
+    rows = conn.execute(text("SELECT id, embedding FROM images WHERE embedding IS NOT NULL")).all()
+    if not rows:
+        return
+    
+    # One-off trusted read of our own legacy rows; pickle is never used for embeddings again
+    conn.execute(
+        text("UPDATE images SET embedding = :embedding WHERE id = :id"),
+        [
+            {"id": row.id, "embedding": np.asarray(pickle.loads(row.embedding), dtype=np.float32).tobytes()}
+            for row in rows
+        ]
+    )
+    logger.info(f"Converted {len(rows)} pickled embeddings to float32 bytes")
+
+def _add_upload_time_index(conn: Connection) -> None:
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_images_upload_time ON images (upload_time DESC)")
+
+def _add_sha256_column(conn: Connection) -> None:
+    # Existing rows keep a NULL digest; SQLite allows many NULLs under a UNIQUE index
+    conn.exec_driver_sql("ALTER TABLE images ADD COLUMN sha256 VARCHAR")
+    conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ix_images_sha256 ON images (sha256)")
+
+def _move_embeddings_to_store(conn: Connection) -> None:
+    """Copy embedding blobs into the float32 sidecar matrix file and record each row's offset"""
+    conn.exec_driver_sql("ALTER TABLE images ADD COLUMN embedding_offset INTEGER")
+    rows = conn.execute(text("SELECT id, embedding FROM images WHERE embedding IS NOT NULL ORDER BY id")).all()
+    if not rows:
+        return
+    
+    legacy_path = _legacy_embeddings_path()
+    row_bytes = EMBEDDING_DIM * np.dtype(np.float32).itemsize
+    with open(legacy_path, "ab") as f:
+        start = os.fstat(f.fileno()).st_size // row_bytes
+        f.truncate(start * row_bytes)
+        for row in rows:
+            f.write(row.embedding)
+    conn.execute(
+        text("UPDATE images SET embedding_offset = :offset, embedding = NULL WHERE id = :id"),
+        [{"id": row.id, "offset": start + i} for i, row in enumerate(rows)]
+    )
+    logger.info(f"Moved {len(rows)} embeddings to {legacy_path}")
+
+def _drop_embedding_column(conn: Connection) -> None:
+    # Emptied by the previous migration; pages it used are reused by later inserts
+    conn.exec_driver_sql("ALTER TABLE images DROP COLUMN embedding")
+
+def _quantize_embedding_store(conn: Connection) -> None:
+    """Re-encode the float32 sidecar file as int8 rows, keeping every row at the same offset"""
+    legacy_path = _legacy_embeddings_path()
+    if not os.path.exists(legacy_path):
+        return
+    
+    store = get_embedding_store()
+    vectors = np.fromfile(legacy_path, dtype=np.float32)
+    vectors = vectors[:len(vectors) - len(vectors) % store.dimension].reshape(-1, store.dimension)
+    if len(store) == len(vectors):
+        # Swapped in by an earlier attempt that failed before the schema version was committed
+        return
+    if len(store):
+        logger.warning(f"{store.path} already holds embeddings, not quantizing {legacy_path}")
+        return
+    
+    # Written beside the target and swapped in, so a crash never leaves a half-converted file
+    temp_path = f"{store.path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    EmbeddingStore(temp_path, store.dimension).extend(vectors)
+    os.replace(temp_path, store.path)
+    logger.info(f"Quantized {len(vectors)} embeddings from {legacy_path} into {store.path}; {legacy_path} can be deleted")
+
+# Applied in order; a migration's position (1-based) is the schema version it produces
+MIGRATIONS = [
+    _embeddings_pickle_to_float32,
+    _add_upload_time_index,
+    _add_sha256_column,
+    _move_embeddings_to_store,
+    _drop_embedding_column,
+    _quantize_embedding_store,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def set_schema_version(conn: Connection, version: int) -> None:
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+def run_migrations(conn: Connection) -> None:
+    """Bring an existing SQLite database up to SCHEMA_VERSION"""
+    if conn.dialect.name != "sqlite":
+        return
+    
+    version = get_schema_version(conn)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Applying database migration {number}: {migration.__name__}")
+        migration(conn)
+        set_schema_version(conn, number)
@@ -1,14 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
 from pydantic import BaseModel, field_validator
 import logging
 
 from ..models.database import get_db, User
 from ..services.auth_service import (
-    verify_password, get_password_hash, create_access_token,
-    verify_token, ACCESS_TOKEN_EXPIRE_MINUTES, validate_password
+    verify_password_cached, get_password_hash, create_access_token,
+    verify_token_cached, ACCESS_TOKEN_EXPIRE_MINUTES, validate_password
 )
 
 logger = logging.getLogger(__name__)
@@ -38,7 +39,7 @@ class UserCreate(BaseModel):
 class UserResponse(BaseModel):
     id: int
     username: str
-    created_at: str
+    created_at: datetime
     is_active: bool
 
 class Token(BaseModel):
@@ -46,10 +47,11 @@ class Token(BaseModel):
     token_type: str
 
 @router.post("/register", response_model=dict)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     try:
         # Check if user exists
-        db_user = db.query(User).filter(User.username == user.username).first()
+        result = await db.execute(select(User).where(User.username == user.username))
+        db_user = result.scalar_one_or_none()
         if db_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -60,8 +62,8 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         hashed_password = get_password_hash(user.password)
         db_user = User(username=user.username, hashed_password=hashed_password)
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         
         logger.info(f"New user registered: {user.username}")
         return {"message": "User created successfully", "user_id": db_user.id}
@@ -76,10 +78,11 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         )
 
 @router.post("/token", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     try:
-        user = db.query(User).filter(User.username == form_data.username).first()
-        if not user or not verify_password(form_data.password, user.hashed_password):
+        result = await db.execute(select(User).where(User.username == form_data.username))
+        user = result.scalar_one_or_none()
+        if not user or not verify_password_cached(form_data.username, form_data.password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
@@ -110,21 +113,23 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
             detail="Error during login"
         )
 
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    # async so the token cache is only touched from the event loop, never from threadpool workers
+    return verify_token_cached(token)
+
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
-    current_user: str = Depends(lambda token=Depends(oauth2_scheme): verify_token(token)),
-    db: Session = Depends(get_db)
+    current_user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(User).filter(User.username == current_user).first()
+    result = await db.execute(select(User).where(User.username == current_user))
+    user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     return UserResponse(
         id=user.id,
         username=user.username,
-        created_at=user.created_at.isoformat(),
+        created_at=user.created_at,
         is_active=bool(user.is_active)
     )
-
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    return verify_token(token)
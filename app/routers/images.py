@@ -1,17 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, status
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
+import asyncio
+import numpy as np
 import os
 import uuid
-from PIL import Image
+import hashlib
 import shutil
 import logging
 from datetime import datetime
 
-from ..models.database import get_db, ImageRecord
+from ..models.database import get_db, insert_image_records, ImageRecord
 from ..services.ml_service import get_ml_service
+from ..services.embedding_store import get_embedding_store
+from ..services.search_index import get_search_index
 from ..routers.auth import get_current_user
+from ..utils.helpers import load_image_rgb, INVALID_IMAGE_ERRORS
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
@@ -19,7 +26,11 @@ router = APIRouter(prefix="/images", tags=["images"])
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "32"))
 ALLOWED_EXTENSIONS = os.getenv("ALLOWED_EXTENSIONS", "jpg,jpeg,png").split(",")
+# Internal Nginx location aliasing UPLOAD_DIR, e.g. /_protected/; empty serves files from Python
+X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX", "")
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -27,7 +38,7 @@ class ImageResponse(BaseModel):
     id: int
     filename: str
     caption: str
-    upload_time: str
+    upload_time: datetime
     file_size: int
     content_type: str
     similarity_score: Optional[float] = None
@@ -41,7 +52,7 @@ class UploadResponse(BaseModel):
     id: int
     filename: str
     caption: str
-    upload_time: str
+    upload_time: datetime
     file_size: int
     message: str
 
@@ -62,38 +73,72 @@ def validate_image_file(file: UploadFile) -> None:
                 detail=f"Only {', '.join(ALLOWED_EXTENSIONS).upper()} images are supported"
             )
 
+async def save_upload_file(file: UploadFile) -> Tuple[str, str, int, str]:
+    """Stream an upload to disk under a unique name, hashing and checking size as chunks arrive.
+
+    Returns (unique_filename, file_path, file_size, sha256 hex digest).
+    """
+    file_extension = file.filename.split(".")[-1].lower()
+    unique_filename = f"{uuid.uuid4()}.{file_extension}"
+    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    
+    file_size = 0
+    file_hash = hashlib.sha256()
+    with open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_FILE_SIZE:
+                break
+            file_hash.update(chunk)
+            buffer.write(chunk)
+    
+    if file_size > MAX_FILE_SIZE:
+        os.remove(file_path)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE} bytes"
+        )
+    
+    return unique_filename, file_path, file_size, file_hash.hexdigest()
+
+def embed_caption(ml_service, caption: str) -> Tuple[np.ndarray, int]:
+    """Embed a caption and append it to the embedding store, returning (embedding, row offset)"""
+    embedding = ml_service.generate_embedding(caption)
+    return embedding, get_embedding_store().append(embedding)
+
+def duplicate_upload_response(image: ImageRecord) -> UploadResponse:
+    return UploadResponse(
+        id=image.id,
+        filename=image.filename,
+        caption=image.caption,
+        upload_time=image.upload_time,
+        file_size=image.file_size,
+        message="Image already uploaded"
+    )
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_image(
     file: UploadFile = File(...),
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         # Validate file
         validate_image_file(file)
         
-        # Check file size
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE} bytes"
-            )
+        unique_filename, file_path, file_size, sha256 = await save_upload_file(file)
         
-        # Generate unique filename
-        file_extension = file.filename.split(".")[-1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
+        # Skip captioning entirely if the same bytes were uploaded before
+        result = await db.execute(select(ImageRecord).where(ImageRecord.sha256 == sha256))
+        existing = result.scalars().first()
+        if existing:
+            os.remove(file_path)
+            return duplicate_upload_response(existing)
         
-        # Validate image by opening it
+        # Validate by decoding once; the decoded image goes straight to the caption model
         try:
-            with Image.open(file_path) as img:
-                img.verify()
-        except Exception as e:
+            image = await asyncio.to_thread(load_image_rgb, file_path)
+        except INVALID_IMAGE_ERRORS:
             os.remove(file_path)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -101,25 +146,34 @@ async def upload_image(
             )
         
         # Get ML service and generate caption
-        ml_service = get_ml_service()
-        caption = ml_service.generate_caption(file_path)
+        # Model calls block for seconds, so they run off the event loop
+        ml_service = await asyncio.to_thread(get_ml_service)
+        caption = await asyncio.to_thread(ml_service.generate_caption_from_pil, image)
         
-        # Generate embedding
-        embedding = ml_service.generate_embedding(caption)
-        embedding_bytes = ml_service.serialize_embedding(embedding)
+        # Generate embedding and write it to the store, both blocking
+        embedding, embedding_offset = await asyncio.to_thread(embed_caption, ml_service, caption)
         
         # Save to database
         db_image = ImageRecord(
             filename=unique_filename,
             caption=caption,
-            embedding=embedding_bytes,
+            embedding_offset=embedding_offset,
             file_path=file_path,
-            file_size=len(file_content),
-            content_type=file.content_type
+            file_size=file_size,
+            content_type=file.content_type,
+            sha256=sha256
         )
         db.add(db_image)
-        db.commit()
-        db.refresh(db_image)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # A concurrent upload of the same bytes won the race
+            await db.rollback()
+            os.remove(file_path)
+            result = await db.execute(select(ImageRecord).where(ImageRecord.sha256 == sha256))
+            return duplicate_upload_response(result.scalar_one())
+        await db.refresh(db_image)
+        get_search_index().add(db_image.id, embedding)
         
         logger.info(f"Image uploaded successfully: {unique_filename} by user {current_user}")
         
@@ -127,7 +181,7 @@ async def upload_image(
             id=db_image.id,
             filename=db_image.filename,
             caption=db_image.caption,
-            upload_time=db_image.upload_time.isoformat(),
+            upload_time=db_image.upload_time,
             file_size=db_image.file_size,
             message="Image uploaded and processed successfully"
         )
@@ -144,50 +198,160 @@ async def upload_image(
             detail=f"Error processing image: {str(e)}"
         )
 
+@router.post("/upload_batch", response_model=List[UploadResponse])
+async def upload_images_batch(
+    files: List[UploadFile] = File(...),
+    current_user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Caption and store several images with one generate call and one multi-row insert"""
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_FILES} images can be uploaded per batch"
+        )
+    
+    saved = []  # (content_type, unique_filename, file_path, file_size, sha256)
+    committed = False  # once the rows exist, their files must stay on disk
+    try:
+        for file in files:
+            validate_image_file(file)
+            saved.append((file.content_type, *await save_upload_file(file)))
+        
+        # Split out files already in the database or repeated within this batch
+        result = await db.execute(
+            select(ImageRecord).where(ImageRecord.sha256.in_([upload[4] for upload in saved]))
+        )
+        existing = {image.sha256: image for image in result.scalars()}
+        new_uploads = {}
+        for upload in saved:
+            if upload[4] in existing or upload[4] in new_uploads:
+                os.remove(upload[2])
+            else:
+                new_uploads[upload[4]] = upload
+        uploads = list(new_uploads.values())
+        
+        responses = {}
+        if uploads:
+            images = []
+            for content_type, unique_filename, file_path, file_size, sha256 in uploads:
+                try:
+                    images.append(await asyncio.to_thread(load_image_rgb, file_path))
+                except INVALID_IMAGE_ERRORS:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Invalid or corrupted image file: {unique_filename}"
+                    )
+            
+            ml_service = await asyncio.to_thread(get_ml_service)
+            captions = await asyncio.to_thread(ml_service.generate_captions_batch, images)
+            embeddings = await asyncio.to_thread(
+                lambda: [ml_service.generate_embedding(caption) for caption in captions]
+            )
+            # One write for the whole batch; its rows are consecutive from the returned offset
+            first_offset = await asyncio.to_thread(get_embedding_store().extend, np.stack(embeddings))
+            
+            records = [
+                {
+                    "filename": unique_filename,
+                    "caption": caption,
+                    "embedding_offset": first_offset + i,
+                    "file_path": file_path,
+                    "file_size": file_size,
+                    "content_type": content_type,
+                    "sha256": sha256
+                }
+                for i, ((content_type, unique_filename, file_path, file_size, sha256), caption)
+                in enumerate(zip(uploads, captions))
+            ]
+            try:
+                rows = await insert_image_records(db, records)
+                committed = True
+            except IntegrityError:
+                await db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Some of these images were uploaded concurrently, please retry"
+                )
+            
+            search_index = get_search_index()
+            for record, row, embedding in zip(records, rows, embeddings):
+                search_index.add(row.id, embedding)
+                responses[record["sha256"]] = UploadResponse(
+                    id=row.id,
+                    filename=record["filename"],
+                    caption=record["caption"],
+                    upload_time=row.upload_time,
+                    file_size=record["file_size"],
+                    message="Image uploaded and processed successfully"
+                )
+        
+        logger.info(f"Batch of {len(uploads)} new images uploaded by user {current_user}")
+        
+        return [
+            responses.get(sha256) or duplicate_upload_response(existing[sha256])
+            for _, _, _, _, sha256 in saved
+        ]
+        
+    except HTTPException:
+        if not committed:
+            for upload in saved:
+                if os.path.exists(upload[2]):
+                    os.remove(upload[2])
+        raise
+    except Exception as e:
+        if not committed:
+            for upload in saved:
+                if os.path.exists(upload[2]):
+                    os.remove(upload[2])
+        logger.error(f"Error uploading image batch: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing images: {str(e)}"
+        )
+
 @router.get("/search", response_model=SearchResponse)
 async def search_images(
     query: str = Query(..., description="Search query", min_length=1),
     limit: int = Query(3, ge=1, le=20, description="Number of results to return"),
     threshold: float = Query(0.0, ge=0.0, le=1.0, description="Minimum similarity threshold"),
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         logger.info(f"Searching images with query: '{query}' by user {current_user}")
         
         # Get ML service and generate query embedding
-        ml_service = get_ml_service()
-        query_embedding = ml_service.generate_embedding(query)
+        ml_service = await asyncio.to_thread(get_ml_service)
+        query_embedding = await asyncio.to_thread(ml_service.generate_embedding, query)
         
-        # Get all images from database
-        images = db.query(ImageRecord).all()
+        # Find nearest images by caption embedding
+        search_index = get_search_index()
+        await search_index.ensure_loaded(db)
+        ranked = [
+            (image_id, similarity) for image_id, similarity in search_index.search(query_embedding, limit)
+            if similarity >= threshold
+        ]
         
-        if not images:
+        if not ranked:
             return SearchResponse(query=query, total_results=0, results=[])
         
-        # Calculate similarities
-        stored_embeddings = []
-        for image in images:
-            embedding = ml_service.deserialize_embedding(image.embedding)
-            stored_embeddings.append(embedding)
-        
-        similarities = ml_service.calculate_similarity(query_embedding, stored_embeddings)
-        
-        # Filter by threshold and sort by similarity
-        image_similarities = [
-            (image, similarity) for image, similarity in zip(images, similarities)
-            if similarity >= threshold
-        ]
-        image_similarities.sort(key=lambda x: x[1], reverse=True)
+        # Fetch display metadata for the top results only
+        top_ids = [image_id for image_id, _ in ranked]
+        result = await db.execute(select(ImageRecord).where(ImageRecord.id.in_(top_ids)))
+        images = {image.id: image for image in result.scalars()}
         
         # Get top results
         results = []
-        for image, similarity in image_similarities[:limit]:
+        for image_id, similarity in ranked:
+            image = images.get(image_id)
+            if image is None:
+                continue
             results.append(ImageResponse(
                 id=image.id,
                 filename=image.filename,
                 caption=image.caption,
-                upload_time=image.upload_time.isoformat(),
+                upload_time=image.upload_time,
                 file_size=image.file_size,
                 content_type=image.content_type,
                 similarity_score=round(similarity, 4)
@@ -213,23 +377,23 @@ async def get_image_history(
     limit: int = Query(50, ge=1, le=100, description="Number of images to return"),
     offset: int = Query(0, ge=0, description="Number of images to skip"),
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
-        images = (
-            db.query(ImageRecord)
+        result = await db.execute(
+            select(ImageRecord)
             .order_by(ImageRecord.upload_time.desc())
             .offset(offset)
             .limit(limit)
-            .all()
         )
+        images = result.scalars().all()
         
         return [
             ImageResponse(
                 id=image.id,
                 filename=image.filename,
                 caption=image.caption,
-                upload_time=image.upload_time.isoformat(),
+                upload_time=image.upload_time,
                 file_size=image.file_size,
                 content_type=image.content_type
             )
@@ -247,9 +411,9 @@ async def get_image_history(
 async def get_image_details(
     image_id: int,
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    image = db.query(ImageRecord).filter(ImageRecord.id == image_id).first()
+    image = await db.get(ImageRecord, image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
@@ -257,7 +421,7 @@ async def get_image_details(
         id=image.id,
         filename=image.filename,
         caption=image.caption,
-        upload_time=image.upload_time.isoformat(),
+        upload_time=image.upload_time,
         file_size=image.file_size,
         content_type=image.content_type
     )
@@ -266,15 +430,25 @@ async def get_image_details(
 async def download_image(
     image_id: int,
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    image = db.query(ImageRecord).filter(ImageRecord.id == image_id).first()
+    image = await db.get(ImageRecord, image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
     if not os.path.exists(image.file_path):
         raise HTTPException(status_code=404, detail="Image file not found on disk")
     
+    if X_ACCEL_REDIRECT_PREFIX:
+        # Nginx sends the file itself with sendfile(2); the API only authorizes the request
+        return Response(
+            media_type=image.content_type,
+            headers={
+                "X-Accel-Redirect": f"{X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{image.filename}",
+                "Content-Disposition": f'attachment; filename="{image.filename}"'
+            }
+        )
+    
     return FileResponse(
         path=image.file_path,
         filename=image.filename,
@@ -285,9 +459,9 @@ async def download_image(
 async def delete_image(
     image_id: int,
     current_user: str = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    image = db.query(ImageRecord).filter(ImageRecord.id == image_id).first()
+    image = await db.get(ImageRecord, image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
@@ -297,8 +471,9 @@ async def delete_image(
             os.remove(image.file_path)
         
         # Delete from database
-        db.delete(image)
-        db.commit()
+        await db.delete(image)
+        await db.commit()
+        get_search_index().invalidate()
         
         logger.info(f"Image deleted: {image.filename} by user {current_user}")
         return {"message": "Image deleted successfully"}
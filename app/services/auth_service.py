@@ -1,9 +1,13 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from cachetools import TTLCache
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
 import os
+import hashlib
+import hmac
+import time
 from dotenv import load_dotenv
 import logging
 
@@ -13,12 +17,33 @@ logger = logging.getLogger(__name__)
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "30"))
+
+LOGIN_CACHE_TTL = int(os.getenv("LOGIN_CACHE_TTL", "5"))
+
+# sha256(token) -> (username, exp) for recently verified tokens
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL)
+# HMAC(username, password) -> the bcrypt hash it matched; successful logins only
+_login_cache = TTLCache(maxsize=1024, ttl=LOGIN_CACHE_TTL)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_password_cached(username: str, plain_password: str, hashed_password: str) -> bool:
+    """verify_password, skipping bcrypt for a login that succeeded in the last LOGIN_CACHE_TTL seconds"""
+    key = hmac.new(SECRET_KEY.encode(), f"{username}\0{plain_password}".encode(), hashlib.sha256).digest()
+    # Keyed on the stored hash too, so a password change invalidates the entry
+    if _login_cache.get(key) == hashed_password:
+        return True
+    
+    # Failures are never cached and always pay the full bcrypt cost
+    if not verify_password(plain_password, hashed_password):
+        return False
+    _login_cache[key] = hashed_password
+    return True
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -33,7 +58,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -43,7 +68,7 @@ def verify_token(token: str):
                 detail="Could not validate credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        return username
+        return payload
     except JWTError as e:
         logger.error(f"JWT Error: {str(e)}")
         raise HTTPException(
@@ -52,6 +77,24 @@ def verify_token(token: str):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+def verify_token(token: str):
+    return decode_token(token)["sub"]
+
+def verify_token_cached(token: str):
+    """verify_token, skipping the HMAC check for tokens verified in the last TOKEN_CACHE_TTL seconds"""
+    key = hashlib.sha256(token.encode()).digest()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        username, expires_at = cached
+        # A cached entry never outlives the token itself
+        if expires_at is None or expires_at > time.time():
+            return username
+        del _token_cache[key]
+    
+    payload = decode_token(token)
+    _token_cache[key] = (payload["sub"], payload.get("exp"))
+    return payload["sub"]
+
 def validate_password(password: str) -> bool:
     if len(password) < 6:
         return False
@@ -0,0 +1,88 @@
+import numpy as np
+from typing import Optional, Tuple
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_PATH = os.getenv("EMBEDDINGS_PATH", "embeddings.q8")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))  # all-MiniLM-L6-v2
+
+def quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """L2-normalize a vector (or the rows of a matrix) and quantize to int8 with one float32 scale per vector"""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+    scales = np.maximum(np.abs(vectors).max(axis=-1, keepdims=True), 1e-12) / 127
+    quantized = np.clip(np.round(vectors / scales), -127, 127).astype(np.int8)
+    return scales[..., 0].astype(np.float32), quantized
+
+def dequantize_embeddings(scales: np.ndarray, quantized: np.ndarray) -> np.ndarray:
+    return quantized.astype(np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+class EmbeddingStore:
+    """Append-only file of fixed-width int8 rows, each with its float32 scale.
+
+    Images reference their vector by row offset. A row is 4 + D bytes instead
+    of 4 * D, and vectors are stored unit-length so search only needs to
+    dequantize them.
+
+    Rows are never reclaimed: a vector written for an upload whose insert then
+    fails (e.g. a duplicate that lost the race) stays in the file unreferenced.
+    """
+
+    def __init__(self, path: str = EMBEDDINGS_PATH, dimension: int = EMBEDDING_DIM):
+        self.path = path
+        self.dimension = dimension
+        self.record_dtype = np.dtype([("scale", "<f4"), ("q", "i1", (dimension,))])
+        self.row_bytes = self.record_dtype.itemsize
+        self._lock = threading.Lock()
+        self._records: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.row_bytes
+
+    def append(self, embedding: np.ndarray) -> int:
+        """Write one embedding and return its row offset"""
+        return self.extend(np.asarray(embedding, dtype=np.float32).reshape(1, self.dimension))
+
+    def extend(self, embeddings: np.ndarray) -> int:
+        """Write an (N, D) block of embeddings and return the row offset of the first"""
+        records = np.empty(len(embeddings), dtype=self.record_dtype)
+        records["scale"], records["q"] = quantize_embeddings(np.asarray(embeddings).reshape(-1, self.dimension))
+        with self._lock, open(self.path, "ab") as f:
+            rows = os.fstat(f.fileno()).st_size // self.row_bytes
+            # Drop any torn row left by a crash so offsets stay aligned
+            f.truncate(rows * self.row_bytes)
+            f.write(records.tobytes())
+        return rows
+
+    def records(self) -> np.ndarray:
+        """Read-only memory-mapped view of every stored row, remapped when the file has grown"""
+        rows = len(self)
+        if rows == 0:
+            return np.empty(0, dtype=self.record_dtype)
+        if self._records is None or self._records.shape[0] != rows:
+            self._records = np.memmap(self.path, dtype=self.record_dtype, mode="r", shape=(rows,))
+        return self._records
+
+    def matrix(self, offsets: Optional[np.ndarray] = None) -> np.ndarray:
+        """Dequantized float32 (N, D) matrix of all rows, or of just the given offsets"""
+        records = self.records()
+        if offsets is not None:
+            records = records[offsets]
+        return dequantize_embeddings(records["scale"], records["q"])
+
+    def get(self, offset: int) -> np.ndarray:
+        return self.matrix(np.array([offset]))[0]
+
+# Global embedding store instance
+embedding_store = None
+
+def get_embedding_store():
+    global embedding_store
+    if embedding_store is None:
+        embedding_store = EmbeddingStore()
+    return embedding_store
@@ -3,12 +3,19 @@ from sentence_transformers import SentenceTransformer
 import torch
 from PIL import Image
 import numpy as np
-import pickle
-from typing import List, Tuple
+import io
+from typing import List, Union
 import logging
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_MAX_LENGTH = 256  # SentenceTransformer's max_seq_length for MiniLM
+ONNX_EMBEDDING_DIR = os.getenv("ONNX_EMBEDDING_DIR", "models/all-MiniLM-L6-v2-onnx-int8")
+ONNX_EMBEDDING_FILE = "model_quantized.onnx"
+
 class MLService:
     def __init__(self):
         try:
@@ -19,11 +26,23 @@ class MLService:
             self.caption_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
             
             # Initialize embedding model
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.use_onnx_embeddings = os.getenv("USE_ONNX_EMBEDDINGS", "false").lower() == "true"
+            if self.use_onnx_embeddings:
+                self._load_onnx_embedding_model()
+            else:
+                self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
             
             # Set device
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            self.caption_model.to(self.device)
+            self.dtype = torch.float16 if self.device.type == "cuda" else torch.float32
+            self.caption_model.to(self.device, dtype=self.dtype)
+            self.caption_model.eval()
+            
+            # Callers run on worker threads; one generate at a time keeps GPU memory bounded
+            self._caption_lock = threading.Lock()
+            
+            if os.getenv("USE_COMPILE", "false").lower() == "true":
+                self._compile_caption_model()
             
             logger.info(f"ML models initialized successfully on device: {self.device}")
             
@@ -31,22 +50,78 @@ class MLService:
             logger.error(f"Error initializing ML models: {str(e)}")
             raise
     
-    def generate_caption(self, image_path: str) -> str:
+    def _load_onnx_embedding_model(self) -> None:
+        """Load MiniLM as a dynamically INT8-quantized ONNX Runtime model, exporting it on first use"""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+        
+        if not os.path.exists(os.path.join(ONNX_EMBEDDING_DIR, ONNX_EMBEDDING_FILE)):
+            logger.info(f"Exporting and quantizing {EMBEDDING_MODEL_NAME} to {ONNX_EMBEDDING_DIR}")
+            exported = ORTModelForFeatureExtraction.from_pretrained(EMBEDDING_MODEL_NAME, export=True)
+            quantizer = ORTQuantizer.from_pretrained(exported)
+            quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=ONNX_EMBEDDING_DIR, quantization_config=quantization_config)
+            AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME).save_pretrained(ONNX_EMBEDDING_DIR)
+        
+        self.embedding_tokenizer = AutoTokenizer.from_pretrained(ONNX_EMBEDDING_DIR)
+        self.embedding_model = ORTModelForFeatureExtraction.from_pretrained(
+            ONNX_EMBEDDING_DIR, file_name=ONNX_EMBEDDING_FILE
+        )
+    
+    def _encode_onnx(self, text: str) -> np.ndarray:
+        # Same mean pooling + L2 normalization as the SentenceTransformer pipeline
+        inputs = self.embedding_tokenizer(
+            text, padding=True, truncation=True, max_length=EMBEDDING_MAX_LENGTH, return_tensors="np"
+        )
+        token_embeddings = self.embedding_model(**inputs).last_hidden_state[0]
+        mask = inputs["attention_mask"][0][:, None].astype(np.float32)
+        embedding = (token_embeddings * mask).sum(axis=0) / np.maximum(mask.sum(), 1e-9)
+        return (embedding / max(np.linalg.norm(embedding), 1e-12)).astype(np.float32)
+    
+    def _compile_caption_model(self) -> None:
+        # generate() is an eager Python loop that calls these forwards, so they
+        # are compiled directly rather than wrapping the whole model
+        mode = os.getenv("COMPILE_MODE", "reduce-overhead")
+        model = self.caption_model
+        model.vision_model.forward = torch.compile(model.vision_model.forward, mode=mode)
+        model.text_decoder.forward = torch.compile(model.text_decoder.forward, mode=mode, dynamic=True)
+        logger.info(f"Caption model compiled with torch.compile (mode={mode})")
+    
+    def _generate_captions(self, images: List[Image.Image]) -> List[str]:
+        inputs = self.caption_processor(images=images, return_tensors="pt").to(self.device, self.dtype)
+        
+        with self._caption_lock, torch.inference_mode():
+            out = self.caption_model.generate(
+                **inputs, 
+                max_new_tokens=30, 
+                num_beams=3,
+                length_penalty=1.0,
+                no_repeat_ngram_size=3,
+                early_stopping=True,
+                use_cache=True
+            )
+        
+        return self.caption_processor.batch_decode(out, skip_special_tokens=True)
+    
+    def generate_caption(self, image: Union[str, bytes, Image.Image]) -> str:
+        """Caption an image given as a file path, encoded bytes or a PIL image"""
+        if isinstance(image, Image.Image):
+            return self.generate_caption_from_pil(image)
+        
+        logger.info(f"Generating caption for image: {image if isinstance(image, str) else 'in-memory bytes'}")
         try:
-            logger.info(f"Generating caption for image: {image_path}")
-            
-            image = Image.open(image_path).convert('RGB')
-            inputs = self.caption_processor(image, return_tensors="pt").to(self.device)
-            
-            with torch.no_grad():
-                out = self.caption_model.generate(
-                    **inputs, 
-                    max_length=50, 
-                    num_beams=5,
-                    early_stopping=True
-                )
-            
-            caption = self.caption_processor.decode(out[0], skip_special_tokens=True)
+            source = io.BytesIO(image) if isinstance(image, bytes) else image
+            image = Image.open(source).convert('RGB')
+        except Exception as e:
+            logger.error(f"Error generating caption: {str(e)}")
+            raise Exception(f"Error generating caption: {str(e)}")
+        return self.generate_caption_from_pil(image)
+    
+    def generate_caption_from_pil(self, image: Image.Image) -> str:
+        """Caption an already decoded image, skipping the file open and decode"""
+        try:
+            caption = self._generate_captions([image.convert('RGB')])[0]
             logger.info(f"Generated caption: {caption}")
             return caption
             
@@ -54,36 +129,42 @@ class MLService:
             logger.error(f"Error generating caption: {str(e)}")
             raise Exception(f"Error generating caption: {str(e)}")
     
+    def generate_captions_batch(self, images: List[Union[str, Image.Image]]) -> List[str]:
+        """Caption several images (paths or decoded PIL images) with a single batched generate call"""
+        try:
+            logger.info(f"Generating captions for {len(images)} images")
+            
+            images = [
+                Image.open(image).convert('RGB') if isinstance(image, str) else image.convert('RGB')
+                for image in images
+            ]
+            captions = self._generate_captions(images)
+            logger.info(f"Generated captions: {captions}")
+            return captions
+            
+        except Exception as e:
+            logger.error(f"Error generating captions: {str(e)}")
+            raise Exception(f"Error generating captions: {str(e)}")
+    
     def generate_embedding(self, text: str) -> np.ndarray:
         try:
             logger.debug(f"Generating embedding for text: {text[:50]}...")
+            if self.use_onnx_embeddings:
+                return self._encode_onnx(text)
             embedding = self.embedding_model.encode(text)
             return embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {str(e)}")
             raise Exception(f"Error generating embedding: {str(e)}")
-    
-    def serialize_embedding(self, embedding: np.ndarray) -> bytes:
-        return pickle.dumps(embedding)
-    
-    def deserialize_embedding(self, embedding_bytes: bytes) -> np.ndarray:
-        return pickle.loads(embedding_bytes)
-    
-    def calculate_similarity(self, query_embedding: np.ndarray, stored_embeddings: List[np.ndarray]) -> List[float]:
-        from sklearn.metrics.pairwise import cosine_similarity
-        
-        similarities = []
-        for stored_embedding in stored_embeddings:
-            similarity = cosine_similarity([query_embedding], [stored_embedding])[0][0]
-            similarities.append(float(similarity))
-        
-        return similarities
 
 # Global ML service instance
 ml_service = None
+_ml_service_lock = threading.Lock()
 
 def get_ml_service():
     global ml_service
     if ml_service is None:
-        ml_service = MLService()
+        with _ml_service_lock:
+            if ml_service is None:
+                ml_service = MLService()
     return ml_service
@@ -0,0 +1,250 @@
+import numpy as np
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
+import logging
+import os
+
+from ..models.database import ImageRecord
+from .embedding_store import get_embedding_store
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search.index")
+HNSW_NEIGHBORS = int(os.getenv("HNSW_NEIGHBORS", "32"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize a vector or the rows of a matrix as float32"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return np.ascontiguousarray(embeddings / np.maximum(norms, 1e-12))
+
+class EmbeddingIndex:
+    """Exact cosine search over a contiguous (N, D) float32 matrix with a parallel id array.
+
+    Rows live in a preallocated buffer that doubles when full, so adding an
+    upload is amortized O(1) instead of copying the whole matrix.
+    """
+
+    def __init__(self, dimension: int, capacity: int = 1024):
+        self.dimension = dimension
+        self._size = 0
+        self._matrix = np.empty((max(capacity, 1), dimension), dtype=np.float32)
+        self._ids = np.empty(max(capacity, 1), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, image_ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Append rows of already normalized vectors"""
+        count = len(image_ids)
+        if self._size + count > len(self._ids):
+            self._grow(self._size + count)
+        self._matrix[self._size:self._size + count] = vectors
+        self._ids[self._size:self._size + count] = image_ids
+        self._size += count
+
+    def search(self, query: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        if self._size == 0:
+            return []
+        similarities = self._matrix[:self._size] @ query
+        top = np.arange(self._size)
+        if limit < self._size:
+            top = np.argpartition(-similarities, limit)[:limit]
+        top = top[np.argsort(-similarities[top])]
+        return [(int(self._ids[i]), float(similarities[i])) for i in top]
+
+    def _grow(self, rows: int) -> None:
+        capacity = max(rows, 2 * len(self._ids))
+        matrix = np.empty((capacity, self.dimension), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+class SearchIndex:
+    """Cosine-similarity index over caption embeddings, keyed by image id.
+
+    Uses a FAISS HNSW graph when faiss is installed and falls back to an exact
+    EmbeddingIndex otherwise.
+    """
+
+    def __init__(self, index_path: str = SEARCH_INDEX_PATH):
+        self.index_path = index_path
+        self._loaded = False
+        self._index = None  # faiss.IndexIDMap2 over IndexHNSWFlat
+        self._exact: Optional[EmbeddingIndex] = None
+        self._lock = asyncio.Lock()
+        self._generation = 0  # bumped by invalidate() so an in-flight build is discarded
+        self._pending: Optional[List[Tuple[int, np.ndarray]]] = None  # uploads seen during a build
+
+    @property
+    def uses_faiss(self) -> bool:
+        return faiss is not None
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        if self._loaded:
+            return
+        async with self._lock:
+            # Another request may have finished the build while we waited
+            if self._loaded:
+                return
+            generation = self._generation
+            self._pending = []
+            try:
+                if not (self.uses_faiss and await self._load_persisted(db)):
+                    await self._build(db)
+                if generation != self._generation:
+                    # An image was deleted mid-build; rebuild on the next search
+                    self._index = None
+                    self._exact = None
+                    return
+                # Uploads committed after the DB was read are only in the buffer
+                indexed = self._indexed_ids()
+                for image_id, embedding in self._pending:
+                    if image_id not in indexed:
+                        self._add_vector(image_id, embedding)
+                self._loaded = True
+            finally:
+                self._pending = None
+
+    def invalidate(self) -> None:
+        """Drop the in-memory index; it is rebuilt from the DB on next use"""
+        self._generation += 1
+        self._loaded = False
+        self._index = None
+        self._exact = None
+        # The saved graph still holds the deleted vectors, and SQLite can hand a
+        # deleted image's id to the next upload, so the id check alone can't catch it
+        if os.path.exists(self.index_path):
+            try:
+                os.remove(self.index_path)
+            except OSError as e:
+                logger.warning(f"Could not remove stale search index {self.index_path}: {str(e)}")
+
+    def add(self, image_id: int, embedding: np.ndarray) -> None:
+        if self._pending is not None:
+            # A build is reading the DB and may miss this row; replayed when it finishes
+            self._pending.append((image_id, embedding))
+            return
+        if not self._loaded:
+            # Picked up from the DB when the index is first loaded
+            return
+        self._add_vector(image_id, embedding)
+
+    def _add_vector(self, image_id: int, embedding: np.ndarray) -> None:
+        vector = normalize(embedding)[None, :]
+        if self.uses_faiss:
+            if self._index is None:
+                self._index = self._new_faiss_index(vector.shape[1])
+            self._index.add_with_ids(vector, np.array([image_id], dtype=np.int64))
+        else:
+            if self._exact is None:
+                self._exact = EmbeddingIndex(vector.shape[1])
+            self._exact.add(np.array([image_id]), vector)
+
+    def _indexed_ids(self) -> set:
+        if self._index is not None:
+            return set(faiss.vector_to_array(self._index.id_map).tolist())
+        if self._exact is not None:
+            return set(self._exact._ids[:len(self._exact)].tolist())
+        return set()
+
+    def search(self, query_embedding: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        """Return up to `limit` (image_id, cosine similarity) pairs, best first"""
+        query = normalize(query_embedding)
+
+        if self.uses_faiss:
+            if self._index is None or self._index.ntotal == 0:
+                return []
+            scores, ids = self._index.search(query[None, :], limit)
+            return [
+                (int(image_id), float(score))
+                for image_id, score in zip(ids[0], scores[0]) if image_id != -1
+            ]
+
+        if self._exact is None:
+            return []
+        return self._exact.search(query, limit)
+
+    def save(self) -> None:
+        """Persist the HNSW graph so the next start can skip rebuilding it"""
+        if self.uses_faiss and self._loaded and self._index is not None:
+            faiss.write_index(self._index, self.index_path)
+            logger.info(f"Saved search index with {self._index.ntotal} vectors to {self.index_path}")
+
+    def _new_faiss_index(self, dimension: int):
+        hnsw = faiss.IndexHNSWFlat(dimension, HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap2(hnsw)
+
+    async def _load_persisted(self, db: AsyncSession) -> bool:
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            index = faiss.read_index(self.index_path)
+            faiss.downcast_index(index.index).hnsw.efSearch = HNSW_EF_SEARCH
+        except Exception as e:
+            logger.warning(f"Could not read search index {self.index_path}: {str(e)}")
+            return False
+
+        # Only trust the file if it covers exactly the images in this database
+        db_ids = np.sort(np.array((await db.execute(select(ImageRecord.id))).scalars().all(), dtype=np.int64))
+        index_ids = np.sort(faiss.vector_to_array(index.id_map))
+        if not np.array_equal(db_ids, index_ids):
+            logger.info("Persisted search index is stale, rebuilding")
+            return False
+
+        self._index = index
+        logger.info(f"Loaded search index with {index.ntotal} vectors from {self.index_path}")
+        return True
+
+    async def _build(self, db: AsyncSession) -> None:
+        rows = (await db.execute(
+            select(ImageRecord.id, ImageRecord.embedding_offset)
+            .where(ImageRecord.embedding_offset.is_not(None))
+        )).all()
+        if not rows:
+            return
+
+        # Rows whose vector is missing from the store (e.g. a lost sidecar file) can't be indexed
+        store = get_embedding_store()
+        stored_rows = len(store)
+        missing = [row.id for row in rows if row.embedding_offset >= stored_rows]
+        if missing:
+            logger.warning(
+                f"{len(missing)} images reference rows past the end of {store.path} "
+                f"({stored_rows} rows) and are not searchable: {missing[:10]}"
+            )
+            rows = [row for row in rows if row.embedding_offset < stored_rows]
+            if not rows:
+                return
+
+        # One gather from the memory-mapped store, dequantized to float32 for BLAS/FAISS
+        ids = [row.id for row in rows]
+        offsets = np.array([row.embedding_offset for row in rows], dtype=np.int64)
+        matrix = normalize(store.matrix(offsets))
+        if self.uses_faiss:
+            self._index = self._new_faiss_index(matrix.shape[1])
+            self._index.add_with_ids(matrix, np.array(ids, dtype=np.int64))
+        else:
+            # Headroom for new uploads before the first resize
+            self._exact = EmbeddingIndex(matrix.shape[1], capacity=2 * len(ids))
+            self._exact.add(np.array(ids, dtype=np.int64), matrix)
+        logger.info(f"Built search index with {len(ids)} vectors")
+
+# Global search index instance
+search_index = None
+
+def get_search_index():
+    global search_index
+    if search_index is None:
+        search_index = SearchIndex()
+    return search_index
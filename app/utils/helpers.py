@@ -1,7 +1,10 @@
 import os
 import logging
 from typing import Optional
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
+
+# Raised by Pillow for unreadable, truncated or oversized images
+INVALID_IMAGE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError)
 
 def setup_logging():
     """Setup logging configuration"""
@@ -17,12 +20,19 @@ def setup_logging():
 def validate_image_format(file_path: str) -> bool:
     """Validate if file is a valid image"""
     try:
+        # load() decodes the pixels, which verify() skips, and leaves the image usable
         with Image.open(file_path) as img:
-            img.verify()
+            img.load()
         return True
-    except Exception:
+    except INVALID_IMAGE_ERRORS:
         return False
 
+def load_image_rgb(file_path: str) -> Image.Image:
+    """Fully decode an image into memory as RGB, raising if it is invalid"""
+    with Image.open(file_path) as img:
+        img.load()
+        return img.convert("RGB")
+
 def get_file_size(file_path: str) -> Optional[int]:
     """Get file size in bytes"""
     try:
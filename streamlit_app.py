@@ -1,9 +1,14 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 import json
 from PIL import Image
 import io
 import time
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Streamlit UI for the API
 st.set_page_config(
@@ -63,27 +68,132 @@ st.markdown('<div class="main-header"><h1>🖼️ AI Image Captioning & Search</
 API_BASE_URL = st.text_input("API Base URL", value="http://localhost:8000", help="Enter the base URL of your API")
 
 # Helper functions
-def download_image(image_id, headers):
+def get_session():
+    """Keep-alive HTTP session for this browser session, reused across reruns"""
+    if "http_session" not in st.session_state:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=2, backoff_factor=0.3)
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        st.session_state.http_session = session
+    return st.session_state.http_session
+
+def set_auth_token(token):
+    """Remember the token and send it with every request on this browser session's HTTP session"""
+    st.session_state.token = token
+    if token:
+        get_session().headers["Authorization"] = f"Bearer {token}"
+    else:
+        get_session().headers.pop("Authorization", None)
+
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def fetch_image_bytes(_session, api_base_url, image_id, token):
+    """Raw image bytes, cached so reruns and page switches don't download them again.
+
+    Like the other fetch_* helpers, `token` only keys the cache per user; the
+    session already sends it.
+    """
+    response = _session.get(f"{api_base_url}/images/{image_id}/download")
+    # Failed downloads raise, so they are never cached
+    response.raise_for_status()
+    return response.content
+
+class APIError(Exception):
+    """Non-200 API response; raised so cached fetches never store a failure"""
+
+def parse_response(response, default_error):
+    if response.status_code != 200:
+        try:
+            detail = response.json().get("detail", default_error)
+        except ValueError:
+            detail = default_error
+        raise APIError(detail)
+    return response.json()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_me(_session, api_base_url, token):
+    response = _session.get(f"{api_base_url}/auth/me")
+    return parse_response(response, "Failed to load user info")
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_history(_session, api_base_url, token, limit, offset):
+    response = _session.get(
+        f"{api_base_url}/images/history",
+        params={"limit": limit, "offset": offset}
+    )
+    return parse_response(response, "Failed to load history")
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_search(_session, api_base_url, token, query, limit, threshold):
+    response = _session.get(
+        f"{api_base_url}/images/search",
+        params={"query": query, "limit": limit, "threshold": threshold}
+    )
+    return parse_response(response, "Search failed")
+
+@st.cache_data(ttl=15, show_spinner=False)
+def check_health(_session, api_base_url):
+    """True if the API is healthy, False if it answered with an error, None if unreachable"""
     try:
-        response = requests.get(f"{API_BASE_URL}/images/{image_id}/download", headers=headers)
-        if response.status_code == 200:
-            return Image.open(io.BytesIO(response.content))
-        return None
-    except Exception as e:
-        st.error(f"Error downloading image: {str(e)}")
+        return _session.get(f"{api_base_url}/health", timeout=2).status_code == 200
+    except requests.RequestException:
         return None
 
-def display_image_with_info(image_data, headers, show_similarity=False):
+def clear_image_caches():
+    """Forget cached listings after the set of images changes"""
+    fetch_history.clear()
+    fetch_search.clear()
+
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def fetch_image_thumbnail(_session, api_base_url, image_id, token, max_side=512):
+    """Downsized WebP copy of a stored image, so cards don't ship full-resolution photos to the browser"""
+    image = Image.open(io.BytesIO(fetch_image_bytes(_session, api_base_url, image_id, token)))
+    image.thumbnail((max_side, max_side))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=80, method=4)
+    return buffer.getvalue()
+
+def prefetch_images(image_ids, token, max_workers=8):
+    """Download and thumbnail a page of images in parallel, returning {image_id: WebP bytes, or None on failure}"""
+    session = get_session()
+    
+    def fetch(image_id):
+        try:
+            return fetch_image_thumbnail(session, API_BASE_URL, image_id, token)
+        except Exception:
+            return None
+    
+    # Workers need the script context to use st.cache_data
+    with ThreadPoolExecutor(
+        max_workers=max_workers,
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx())
+    ) as executor:
+        return dict(zip(image_ids, executor.map(fetch, image_ids)))
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def preview_thumbnail(file_bytes, max_side=512):
+    """Downsized JPEG preview of an upload, decoded once per distinct file"""
+    image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
+    image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+def display_image_with_info(image_data, thumbnail, show_similarity=False):
     col1, col2 = st.columns([1, 2])
     
     with col1:
-        # Download and display image
-        with st.spinner("Loading image..."):
-            image = download_image(image_data["id"], headers)
-            if image:
-                st.image(image, caption=f"ID: {image_data['id']}", use_column_width=True)
-            else:
-                st.error("Failed to load image")
+        if thumbnail:
+            st.image(thumbnail, caption=f"ID: {image_data['id']}", use_column_width=True)
+        else:
+            st.error("Failed to load image")
     
     with col2:
         st.markdown(f"**Caption:** {image_data['caption']}")
@@ -97,6 +207,57 @@ def display_image_with_info(image_data, headers, show_similarity=False):
             st.markdown(f'<span class="similarity-score">Similarity: {similarity_percentage:.1f}%</span>', 
                        unsafe_allow_html=True)
 
+@st.fragment
+def history_card(item, thumbnail):
+    """One history entry; its buttons rerun only this card instead of the whole page"""
+    with st.container():
+        st.markdown('<div class="image-container">', unsafe_allow_html=True)
+        
+        # Add action buttons
+        col1, col2 = st.columns([4, 1])
+        
+        with col1:
+            display_image_with_info(item, thumbnail)
+        
+        with col2:
+            st.markdown("**Actions:**")
+            
+            # Download button
+            # Served from the download cache the thumbnail was built from, so one click saves the file
+            try:
+                image_bytes = fetch_image_bytes(get_session(), API_BASE_URL, item['id'], st.session_state.token)
+            except Exception:
+                image_bytes = None
+            st.download_button(
+                label="💾 Download",
+                data=image_bytes or b"",
+                file_name=item['filename'],
+                mime=item['content_type'],
+                key=f"download_{item['id']}",
+                disabled=image_bytes is None
+            )
+            
+            # Delete button
+            if st.button(f"🗑️ Delete", key=f"delete_{item['id']}", type="secondary"):
+                if st.session_state.get(f"confirm_delete_{item['id']}", False):
+                    with st.spinner("Deleting..."):
+                        try:
+                            response = get_session().delete(f"{API_BASE_URL}/images/{item['id']}")
+                            if response.status_code == 200:
+                                clear_image_caches()
+                                st.success("✅ Image deleted!")
+                                time.sleep(1)
+                                st.rerun()
+                            else:
+                                st.error("❌ Delete failed")
+                        except Exception as e:
+                            st.error(f"❌ Error: {str(e)}")
+                else:
+                    st.session_state[f"confirm_delete_{item['id']}"] = True
+                    st.warning("⚠️ Click again to confirm deletion")
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+
 # Authentication section
 st.sidebar.header("🔐 Authentication")
 
@@ -117,12 +278,12 @@ if st.session_state.token is None:
             if username and password:
                 with st.spinner("Logging in..."):
                     try:
-                        response = requests.post(
+                        response = get_session().post(
                             f"{API_BASE_URL}/auth/token",
                             data={"username": username, "password": password}
                         )
                         if response.status_code == 200:
-                            st.session_state.token = response.json()["access_token"]
+                            set_auth_token(response.json()["access_token"])
                             st.success("✅ Logged in successfully!")
                             time.sleep(1)
                             st.rerun()
@@ -143,7 +304,7 @@ if st.session_state.token is None:
             if reg_username and reg_password:
                 with st.spinner("Creating account..."):
                     try:
-                        response = requests.post(
+                        response = get_session().post(
                             f"{API_BASE_URL}/auth/register",
                             json={"username": reg_username, "password": reg_password}
                         )
@@ -160,11 +321,8 @@ if st.session_state.token is None:
 else:
     # Get user info
     if st.session_state.user_info is None:
-        headers = {"Authorization": f"Bearer {st.session_state.token}"}
         try:
-            response = requests.get(f"{API_BASE_URL}/auth/me", headers=headers)
-            if response.status_code == 200:
-                st.session_state.user_info = response.json()
+            st.session_state.user_info = fetch_me(get_session(), API_BASE_URL, st.session_state.token)
         except:
             pass
     
@@ -175,12 +333,10 @@ else:
         st.sidebar.success("👋 Logged in!")
     
     if st.sidebar.button("🚪 Logout", use_container_width=True):
-        st.session_state.token = None
+        set_auth_token(None)
         st.session_state.user_info = None
         st.rerun()
     
-    headers = {"Authorization": f"Bearer {st.session_state.token}"}
-    
     # Main interface
     tab1, tab2, tab3 = st.tabs(["📤 Upload Image", "🔍 Search Images", "📚 History"])
     
@@ -200,14 +356,13 @@ else:
             
             with col1:
                 st.subheader("Preview")
-                image = Image.open(uploaded_file)
-                st.image(image, caption="Uploaded Image", use_column_width=True)
+                st.image(preview_thumbnail(uploaded_file.getvalue()), caption="Uploaded Image", use_column_width=True)
                 
                 # Show file info
                 st.info(f"""
                 **File Info:**
                 - Name: {uploaded_file.name}
-                - Size: {len(uploaded_file.getvalue()):,} bytes
+                - Size: {uploaded_file.size:,} bytes
                 - Type: {uploaded_file.type}
                 """)
             
@@ -219,12 +374,15 @@ else:
                         try:
                             # Reset file pointer
                             uploaded_file.seek(0)
-                            files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
+                            # Streams the file into the request body instead of building it in memory
+                            encoder = MultipartEncoder(
+                                fields={"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
+                            )
                             
-                            response = requests.post(
+                            response = get_session().post(
                                 f"{API_BASE_URL}/images/upload",
-                                files=files,
-                                headers=headers
+                                data=encoder,
+                                headers={"Content-Type": encoder.content_type}
                             )
                             
                             if response.status_code == 200:
@@ -240,6 +398,7 @@ else:
                                 """, unsafe_allow_html=True)
                                 
                                 # Auto-refresh other tabs
+                                clear_image_caches()
                                 st.balloons()
                             else:
                                 error_detail = response.json().get("detail", "Upload failed")
@@ -256,59 +415,63 @@ else:
         st.header("🔍 Search Images")
         st.markdown("Search your uploaded images using natural language queries.")
         
-        col1, col2 = st.columns([3, 1])
-        
-        with col1:
-            search_query = st.text_input(
-                "Enter search query:", 
-                placeholder="e.g., 'cat sitting on a chair', 'sunset over mountains', 'red car'",
-                help="Describe what you're looking for in natural language"
-            )
-        
-        with col2:
-            search_limit = st.selectbox("Results", [3, 5, 10], index=0, help="Number of results to return")
-        
-        # Advanced options
-        with st.expander("🔧 Advanced Options"):
-            threshold = st.slider(
-                "Similarity Threshold", 
-                0.0, 1.0, 0.0, 0.1,
-                help="Minimum similarity score (0.0 = show all, 1.0 = exact match only)"
-            )
+        # A form reruns the script once on submit instead of on every widget change
+        with st.form("search_form"):
+            col1, col2 = st.columns([3, 1])
+            
+            with col1:
+                search_query = st.text_input(
+                    "Enter search query:", 
+                    placeholder="e.g., 'cat sitting on a chair', 'sunset over mountains', 'red car'",
+                    help="Describe what you're looking for in natural language"
+                )
+            
+            with col2:
+                search_limit = st.selectbox("Results", [3, 5, 10], index=0, help="Number of results to return")
+            
+            # Advanced options
+            with st.expander("🔧 Advanced Options"):
+                threshold = st.slider(
+                    "Similarity Threshold", 
+                    0.0, 1.0, 0.0, 0.1,
+                    help="Minimum similarity score (0.0 = show all, 1.0 = exact match only)"
+                )
+            
+            submitted = st.form_submit_button("🔍 Search Images", use_container_width=True, type="primary")
         
-        if st.button("🔍 Search Images", use_container_width=True, type="primary") and search_query:
+        if submitted and search_query:
             with st.spinner("Searching images... Analyzing semantic similarity..."):
                 try:
-                    response = requests.get(
-                        f"{API_BASE_URL}/images/search",
-                        params={"query": search_query, "limit": search_limit, "threshold": threshold},
-                        headers=headers
+                    results = fetch_search(
+                        get_session(), API_BASE_URL, st.session_state.token,
+                        search_query, search_limit, threshold
                     )
                     
-                    if response.status_code == 200:
-                        results = response.json()
+                    if results['total_results'] > 0:
+                        st.success(f"🎯 Found {results['total_results']} matching images for: **{results['query']}**")
+                        
+                        with st.spinner("Loading images..."):
+                            images = prefetch_images(
+                                [result["id"] for result in results['results']], st.session_state.token
+                            )
                         
-                        if results['total_results'] > 0:
-                            st.success(f"🎯 Found {results['total_results']} matching images for: **{results['query']}**")
+                        for i, result in enumerate(results['results'], 1):
+                            st.markdown(f"### 🖼️ Result {i}")
+                            with st.container():
+                                st.markdown('<div class="image-container">', unsafe_allow_html=True)
+                                display_image_with_info(result, images[result['id']], show_similarity=True)
+                                st.markdown('</div>', unsafe_allow_html=True)
                             
-                            for i, result in enumerate(results['results'], 1):
-                                st.markdown(f"### 🖼️ Result {i}")
-                                with st.container():
-                                    st.markdown('<div class="image-container">', unsafe_allow_html=True)
-                                    display_image_with_info(result, headers, show_similarity=True)
-                                    st.markdown('</div>', unsafe_allow_html=True)
-                                
-                                if i < len(results['results']):
-                                    st.divider()
-                        else:
-                            st.info(f"🤷‍♂️ No images found matching: **{search_query}**")
-                            st.markdown("**Suggestions:**")
-                            st.markdown("- Try different keywords")
-                            st.markdown("- Lower the similarity threshold")
-                            st.markdown("- Upload more images first")
+                            if i < len(results['results']):
+                                st.divider()
                     else:
-                        error_detail = response.json().get("detail", "Search failed")
-                        st.error(f"❌ {error_detail}")
+                        st.info(f"🤷‍♂️ No images found matching: **{search_query}**")
+                        st.markdown("**Suggestions:**")
+                        st.markdown("- Try different keywords")
+                        st.markdown("- Lower the similarity threshold")
+                        st.markdown("- Upload more images first")
+                except APIError as e:
+                    st.error(f"❌ {str(e)}")
                 except Exception as e:
                     st.error(f"❌ Connection error: {str(e)}")
     
@@ -320,6 +483,7 @@ else:
         
         with col1:
             if st.button("🔄 Refresh History", use_container_width=True):
+                fetch_history.clear()
                 st.rerun()
         
         with col2:
@@ -332,97 +496,38 @@ else:
         with st.spinner("Loading image history..."):
             try:
                 offset = st.session_state.history_page * items_per_page
-                response = requests.get(
-                    f"{API_BASE_URL}/images/history",
-                    params={"limit": items_per_page, "offset": offset},
-                    headers=headers
+                history = fetch_history(
+                    get_session(), API_BASE_URL, st.session_state.token, items_per_page, offset
                 )
                 
-                if response.status_code == 200:
-                    history = response.json()
+                if history:
+                    st.success(f"📊 Showing {len(history)} images (Page {st.session_state.history_page + 1})")
                     
-                    if history:
-                        st.success(f"📊 Showing {len(history)} images (Page {st.session_state.history_page + 1})")
-                        
-                        # Pagination controls
-                        col1, col2, col3 = st.columns([1, 2, 1])
-                        
-                        with col1:
-                            if st.button("⬅️ Previous", disabled=st.session_state.history_page == 0):
-                                st.session_state.history_page -= 1
-                                st.rerun()
-                        
-                        with col3:
-                            if st.button("➡️ Next", disabled=len(history) < items_per_page):
-                                st.session_state.history_page += 1
-                                st.rerun()
+                    # Pagination controls
+                    col1, col2, col3 = st.columns([1, 2, 1])
+                    
+                    with col1:
+                        if st.button("⬅️ Previous", disabled=st.session_state.history_page == 0):
+                            st.session_state.history_page -= 1
+                            st.rerun()
+                    
+                    with col3:
+                        if st.button("➡️ Next", disabled=len(history) < items_per_page):
+                            st.session_state.history_page += 1
+                            st.rerun()
+                    
+                    # Display images
+                    images = prefetch_images([item["id"] for item in history], st.session_state.token)
+                    for i, item in enumerate(history, 1):
+                        st.markdown(f"### 🖼️ Image {offset + i}")
+                        history_card(item, images[item['id']])
                         
-                        # Display images
-                        for i, item in enumerate(history, 1):
-                            st.markdown(f"### 🖼️ Image {offset + i}")
-                            with st.container():
-                                st.markdown('<div class="image-container">', unsafe_allow_html=True)
-                                
-                                # Add action buttons
-                                col1, col2 = st.columns([4, 1])
-                                
-                                with col1:
-                                    display_image_with_info(item, headers)
-                                
-                                with col2:
-                                    st.markdown("**Actions:**")
-                                    
-                                    # Download button
-                                    if st.button(f"💾 Download", key=f"download_{item['id']}"):
-                                        with st.spinner("Downloading..."):
-                                            try:
-                                                response = requests.get(
-                                                    f"{API_BASE_URL}/images/{item['id']}/download",
-                                                    headers=headers
-                                                )
-                                                if response.status_code == 200:
-                                                    st.download_button(
-                                                        label="📥 Save File",
-                                                        data=response.content,
-                                                        file_name=item['filename'],
-                                                        mime=item['content_type'],
-                                                        key=f"save_{item['id']}"
-                                                    )
-                                                else:
-                                                    st.error("Download failed")
-                                            except Exception as e:
-                                                st.error(f"Error: {str(e)}")
-                                    
-                                    # Delete button
-                                    if st.button(f"🗑️ Delete", key=f"delete_{item['id']}", type="secondary"):
-                                        if st.session_state.get(f"confirm_delete_{item['id']}", False):
-                                            with st.spinner("Deleting..."):
-                                                try:
-                                                    response = requests.delete(
-                                                        f"{API_BASE_URL}/images/{item['id']}",
-                                                        headers=headers
-                                                    )
-                                                    if response.status_code == 200:
-                                                        st.success("✅ Image deleted!")
-                                                        time.sleep(1)
-                                                        st.rerun()
-                                                    else:
-                                                        st.error("❌ Delete failed")
-                                                except Exception as e:
-                                                    st.error(f"❌ Error: {str(e)}")
-                                        else:
-                                            st.session_state[f"confirm_delete_{item['id']}"] = True
-                                            st.warning("⚠️ Click again to confirm deletion")
-                                
-                                st.markdown('</div>', unsafe_allow_html=True)
-                            
-                            if i < len(history):
-                                st.divider()
-                    else:
-                        st.info("📭 No images uploaded yet.")
+                        if i < len(history):
+                            st.divider()
                 else:
-                    error_detail = response.json().get("detail", "Failed to load history")
-                    st.error(f"❌ {error_detail}")
+                    st.info("📭 No images uploaded yet.")
+            except APIError as e:
+                st.error(f"❌ {str(e)}")
             except Exception as e:
                 st.error(f"❌ Connection error: {str(e)}")
 
@@ -439,12 +544,11 @@ st.markdown("""
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 📊 API Status")
 
-# Check API health
-try:
-    health_response = requests.get(f"{API_BASE_URL}/health", timeout=5)
-    if health_response.status_code == 200:
-        st.sidebar.success("🟢 API Online")
-    else:
-        st.sidebar.error("🔴 API Issues")
-except:
+# Check API health, at most every 15 seconds rather than on every rerun
+api_healthy = check_health(get_session(), API_BASE_URL)
+if api_healthy:
+    st.sidebar.success("🟢 API Online")
+elif api_healthy is False:
+    st.sidebar.error("🔴 API Issues")
+else:
     st.sidebar.error("🔴 API Offline")
@@ -1,53 +1,90 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+import asyncio
 import tempfile
 import os
 from PIL import Image
 import io
 
+# Point the app's own engine, vectors and search index at test locations so
+# startup migrations never touch the real database or its sidecar files
+TEST_DATA_DIR = tempfile.mkdtemp(prefix="image-api-tests-")
+# Shared-cache in-memory database: every connection in this process sees the same data
+TEST_DATABASE_URL = "sqlite:///file:testdb?mode=memory&cache=shared&uri=true"
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+os.environ["EMBEDDINGS_PATH"] = os.path.join(TEST_DATA_DIR, "embeddings.q8")
+os.environ["SEARCH_INDEX_PATH"] = os.path.join(TEST_DATA_DIR, "search.index")
+
 from app.main import app
-from app.models.database import Base, get_db
+from app.models.database import get_db, create_tables, to_async_url, Base
+
+# The single StaticPool connection keeps the in-memory database alive for the whole run,
+# including while the app's own engine is disposed at each TestClient shutdown
+engine = create_async_engine(to_async_url(TEST_DATABASE_URL), poolclass=StaticPool)
+TestingSessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
 
-# Create test database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@event.listens_for(engine.sync_engine, "connect")
+def _set_test_pragmas(dbapi_conn, connection_record):
+    # Nothing to make durable, so skip journaling to disk and fsync
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=MEMORY")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.close()
 
-Base.metadata.create_all(bind=engine)
+async def init_test_db():
+    async with engine.connect():
+        pass
+    # Same setup as app startup, so the schema version matches and no migrations run
+    await create_tables()
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def drop_test_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
+async def override_get_db():
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-app.dependency_overrides[get_db] = override_get_db
+@pytest.fixture(scope="session", autouse=True)
+def test_db():
+    """Create the test schema and route the app's sessions to it, once per run rather than at import"""
+    asyncio.run(init_test_db())
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    app.dependency_overrides.pop(get_db, None)
+    asyncio.run(drop_test_db())
 
 @pytest.fixture
 def client():
     with TestClient(app) as test_client:
         yield test_client
 
-@pytest.fixture
-def test_image():
-    """Create a test image file"""
+@pytest.fixture(scope="session")
+def test_image_bytes():
+    """Encode the test JPEG once per run"""
     image = Image.new('RGB', (100, 100), color='red')
     img_bytes = io.BytesIO()
     image.save(img_bytes, format='JPEG')
-    img_bytes.seek(0)
-    return img_bytes
+    return img_bytes.getvalue()
 
 @pytest.fixture
-def auth_headers(client):
-    """Get authentication headers for testing"""
-    # Register user
-    client.post("/auth/register", json={"username": "testuser", "password": "testpass123"})
-    
-    # Login and get token
-    response = client.post("/auth/token", data={"username": "testuser", "password": "testpass123"})
-    token = response.json()["access_token"]
+def test_image(test_image_bytes):
+    """Create a test image file"""
+    return io.BytesIO(test_image_bytes)
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authentication headers for testing, once per module"""
+    with TestClient(app) as client:
+        # Register user
+        client.post("/auth/register", json={"username": "testuser", "password": "testpass123"})
+        
+        # Login and get token
+        response = client.post("/auth/token", data={"username": "testuser", "password": "testpass123"})
+        token = response.json()["access_token"]
     
     return {"Authorization": f"Bearer {token}"}
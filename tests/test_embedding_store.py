@@ -0,0 +1,42 @@
+import numpy as np
+
+from app.services.embedding_store import EmbeddingStore, EMBEDDING_DIM
+
+def unit_rows(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def test_extend_matrix_round_trip(tmp_path):
+    """Test rows come back unit-length and within int8 precision at the offsets extend returned"""
+    store = EmbeddingStore(str(tmp_path / "embeddings.q8"))
+    vectors = np.random.default_rng(0).standard_normal((5, EMBEDDING_DIM)).astype(np.float32)
+
+    assert store.extend(vectors[:3]) == 0
+    assert store.extend(vectors[3:]) == 3
+    assert store.append(vectors[0]) == 5
+    assert len(store) == 6
+    assert store.row_bytes == 4 + EMBEDDING_DIM
+
+    matrix = store.matrix()
+    assert matrix.shape == (6, EMBEDDING_DIM)
+    assert matrix.dtype == np.float32
+    assert np.allclose(matrix[:5], unit_rows(vectors), atol=1 / 127)
+    assert np.allclose(store.matrix(np.array([4, 1])), matrix[[4, 1]])
+    assert np.allclose(store.get(5), matrix[0])
+
+def test_extend_drops_torn_row(tmp_path):
+    """Test a partial row left by a crash is overwritten so offsets stay aligned"""
+    store = EmbeddingStore(str(tmp_path / "embeddings.q8"))
+    vectors = np.random.default_rng(1).standard_normal((2, EMBEDDING_DIM)).astype(np.float32)
+    store.append(vectors[0])
+    with open(store.path, "ab") as f:
+        f.write(b"\0" * 10)
+
+    assert store.append(vectors[1]) == 1
+    assert len(store) == 2
+    assert np.allclose(store.get(1), unit_rows(vectors)[1], atol=1 / 127)
+
+def test_empty_store(tmp_path):
+    """Test a store whose file doesn't exist yet has no rows"""
+    store = EmbeddingStore(str(tmp_path / "embeddings.q8"))
+    assert len(store) == 0
+    assert store.matrix().shape == (0, EMBEDDING_DIM)
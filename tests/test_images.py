@@ -14,6 +14,38 @@ def test_upload_image(client, auth_headers, test_image):
     assert "caption" in response.json()
     assert "id" in response.json()
 
+def test_upload_duplicate_image(client, auth_headers, test_image):
+    """Test re-uploading identical bytes returns the existing image"""
+    image_bytes = test_image.getvalue()
+    first = client.post(
+        "/images/upload",
+        files={"file": ("first.jpg", image_bytes, "image/jpeg")},
+        headers=auth_headers
+    )
+    second = client.post(
+        "/images/upload",
+        files={"file": ("second.jpg", image_bytes, "image/jpeg")},
+        headers=auth_headers
+    )
+    assert second.status_code == 200
+    assert second.json()["id"] == first.json()["id"]
+    assert second.json()["message"] == "Image already uploaded"
+
+def test_upload_batch(client, auth_headers):
+    """Test uploading several images in one request"""
+    files = []
+    for i, color in enumerate(["blue", "green"]):
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (100, 100), color=color).save(img_bytes, format='JPEG')
+        files.append(("files", (f"batch{i}.jpg", img_bytes.getvalue(), "image/jpeg")))
+    
+    response = client.post("/images/upload_batch", files=files, headers=auth_headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert len(results) == 2
+    assert results[0]["id"] != results[1]["id"]
+    assert all("caption" in result for result in results)
+
 def test_upload_invalid_file(client, auth_headers):
     """Test uploading invalid file"""
     # Create a text file instead of image
@@ -26,6 +58,17 @@ def test_upload_invalid_file(client, auth_headers):
     )
     assert response.status_code == 400
 
+def test_upload_corrupted_image(client, auth_headers, test_image):
+    """Test uploading a truncated JPEG is rejected"""
+    truncated = test_image.getvalue()[:200]
+    
+    response = client.post(
+        "/images/upload",
+        files={"file": ("broken.jpg", truncated, "image/jpeg")},
+        headers=auth_headers
+    )
+    assert response.status_code == 400
+
 def test_search_images(client, auth_headers, test_image):
     """Test image search"""
     # First upload an image
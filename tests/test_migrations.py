@@ -0,0 +1,78 @@
+import pytest
+import pickle
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from app.models import migrations
+from app.models.migrations import run_migrations, get_schema_version, set_schema_version, SCHEMA_VERSION
+from app.services import embedding_store
+from app.services.embedding_store import EmbeddingStore, EMBEDDING_DIM
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Point the migrations at an empty int8 store and float32 file under tmp_path"""
+    store = EmbeddingStore(str(tmp_path / "embeddings.q8"))
+    monkeypatch.setattr(embedding_store, "embedding_store", store)
+    monkeypatch.setattr(migrations, "LEGACY_EMBEDDINGS_PATH", str(tmp_path / "embeddings.f32"))
+    return store
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).standard_normal((3, EMBEDDING_DIM)).astype(np.float32)
+
+@pytest.fixture
+def legacy_engine(tmp_path, vectors):
+    """A database from before the first migration, with pickled numpy embeddings in the images table"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'images.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE images (id INTEGER PRIMARY KEY, filename VARCHAR UNIQUE, caption TEXT, "
+            "embedding BLOB, upload_time DATETIME, file_path VARCHAR, file_size INTEGER, content_type VARCHAR)"
+        )
+        conn.execute(
+            text("INSERT INTO images (filename, caption, embedding) VALUES (:filename, 'a caption', :embedding)"),
+            [{"filename": f"{i}.jpg", "embedding": pickle.dumps(vector)} for i, vector in enumerate(vectors)]
+        )
+    yield engine
+    engine.dispose()
+
+def assert_quantized(engine, store, vectors):
+    with engine.connect() as conn:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        columns = [row.name for row in conn.execute(text("PRAGMA table_info(images)"))]
+        rows = conn.execute(text("SELECT id, embedding_offset FROM images ORDER BY id")).all()
+    assert "embedding" not in columns
+    assert len(store) == len(vectors)
+    expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for row in rows:
+        assert np.allclose(store.get(row.embedding_offset), expected[row.id - 1], atol=1 / 127)
+
+def test_migrate_pickled_embeddings_to_int8_store(legacy_engine, store, vectors):
+    """Test migrations move pickled embeddings through the float32 file into the int8 store"""
+    with legacy_engine.begin() as conn:
+        run_migrations(conn)
+
+    assert_quantized(legacy_engine, store, vectors)
+
+def test_quantize_rerun_after_swap(legacy_engine, store, vectors, caplog):
+    """Test migration 6 is a no-op when the store was swapped in but the schema version was not saved"""
+    with legacy_engine.begin() as conn:
+        run_migrations(conn)
+    with open(store.path, "rb") as f:
+        quantized = f.read()
+
+    with legacy_engine.begin() as conn:
+        set_schema_version(conn, SCHEMA_VERSION - 1)
+        run_migrations(conn)
+
+    with open(store.path, "rb") as f:
+        assert f.read() == quantized
+    assert "already holds embeddings" not in caplog.text
+    assert_quantized(legacy_engine, store, vectors)
+
+def test_legacy_path_must_differ_from_store(legacy_engine, store, monkeypatch):
+    """Test the float32 file is never written over the int8 store"""
+    monkeypatch.setattr(migrations, "LEGACY_EMBEDDINGS_PATH", store.path)
+    with pytest.raises(RuntimeError):
+        with legacy_engine.begin() as conn:
+            run_migrations(conn)
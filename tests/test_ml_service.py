@@ -1,14 +1,15 @@
 import pytest
 import tempfile
 import os
+import io
 from PIL import Image
 
-from app.services.ml_service import MLService
+from app.services.ml_service import get_ml_service
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def ml_service():
-    """Create ML service instance for testing"""
-    return MLService()
+    """Shared ML service instance, so the models load once per module"""
+    return get_ml_service()
 
 @pytest.fixture
 def test_image_path():
@@ -25,23 +26,30 @@ def test_generate_caption(ml_service, test_image_path):
     assert isinstance(caption, str)
     assert len(caption) > 0
 
+def test_generate_caption_from_bytes(ml_service):
+    """Test caption generation from encoded bytes without a temp file"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (100, 100), color='blue').save(buffer, format='JPEG')
+    caption = ml_service.generate_caption(buffer.getvalue())
+    assert isinstance(caption, str)
+    assert len(caption) > 0
+
+def test_generate_caption_from_pil(ml_service):
+    """Test caption generation from an in-memory image"""
+    image = Image.new('RGB', (100, 100), color='green')
+    caption = ml_service.generate_caption_from_pil(image)
+    assert isinstance(caption, str)
+    assert len(caption) > 0
+
+def test_generate_captions_batch(ml_service, test_image_path):
+    """Test batched caption generation"""
+    captions = ml_service.generate_captions_batch([test_image_path, test_image_path])
+    assert len(captions) == 2
+    assert all(isinstance(caption, str) and len(caption) > 0 for caption in captions)
+
 def test_generate_embedding(ml_service):
     """Test embedding generation"""
     text = "A beautiful sunset over the ocean"
     embedding = ml_service.generate_embedding(text)
     assert embedding is not None
     assert len(embedding) > 0
-
-def test_serialize_deserialize_embedding(ml_service):
-    """Test embedding serialization and deserialization"""
-    text = "Test text for embedding"
-    embedding = ml_service.generate_embedding(text)
-    
-    # Serialize
-    serialized = ml_service.serialize_embedding(embedding)
-    assert isinstance(serialized, bytes)
-    
-    # Deserialize
-    deserialized = ml_service.deserialize_embedding(serialized)
-    assert deserialized.shape == embedding.shape
-    assert (deserialized == embedding).all()
@@ -0,0 +1,89 @@
+import numpy as np
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from app.services.embedding_store import EMBEDDING_DIM, get_embedding_store
+from app.services.search_index import EmbeddingIndex, SearchIndex, normalize
+
+def test_embedding_index_grows_and_ranks():
+    """Test the exact index keeps ids aligned with rows across resizes"""
+    vectors = normalize(np.random.default_rng(0).standard_normal((10, 8)))
+    index = EmbeddingIndex(8, capacity=2)
+    for image_id, vector in enumerate(vectors, 1):
+        index.add(np.array([image_id]), vector[None, :])
+    
+    assert len(index) == 10
+    results = index.search(vectors[6], 3)
+    assert len(results) == 3
+    assert results[0][0] == 7
+    assert abs(results[0][1] - 1.0) < 1e-5
+    assert results[0][1] >= results[1][1] >= results[2][1]
+
+def test_embedding_index_empty():
+    """Test searching an empty index returns nothing"""
+    index = EmbeddingIndex(8)
+    assert index.search(np.ones(8, dtype=np.float32), 3) == []
+
+class FakeDB:
+    """Stands in for an AsyncSession over the given (id, embedding_offset) rows; queries yield to other tasks"""
+
+    def __init__(self, rows=()):
+        self.rows = [SimpleNamespace(id=image_id, embedding_offset=offset) for image_id, offset in rows]
+        self.queries = 0
+
+    async def execute(self, statement):
+        self.queries += 1
+        await asyncio.sleep(0.01)
+        return FakeResult(self.rows)
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+    def scalars(self):
+        return FakeResult([row.id for row in self.rows])
+
+def test_search_index_keeps_uploads_added_during_build(tmp_path):
+    """Test concurrent first searches build once and keep an upload made mid-build"""
+    index = SearchIndex(index_path=str(tmp_path / "search.index"))
+    db = FakeDB()
+    vector = normalize(np.arange(1, 9, dtype=np.float32))
+
+    async def upload_during_build():
+        await asyncio.sleep(0)
+        index.add(42, vector)
+
+    async def run():
+        await asyncio.gather(index.ensure_loaded(db), index.ensure_loaded(db), upload_during_build())
+
+    asyncio.run(run())
+    assert db.queries == 1
+    results = index.search(vector, 5)
+    assert [image_id for image_id, _ in results] == [42]
+
+def test_search_index_not_reloaded_after_delete(tmp_path):
+    """Test a saved index is not reused once a deleted image's id is given to a new upload"""
+    pytest.importorskip("faiss")
+    index_path = str(tmp_path / "search.index")
+    store = get_embedding_store()
+    old, new = normalize(np.random.default_rng(1).standard_normal((2, EMBEDDING_DIM)))
+    start = store.extend(np.stack([old, old[::-1]]))
+    
+    index = SearchIndex(index_path=index_path)
+    asyncio.run(index.ensure_loaded(FakeDB([(1, start + 1), (2, start)])))
+    index.save()
+    
+    # Image 2 is deleted and SQLite reuses its id for the next upload
+    index.invalidate()
+    db = FakeDB([(1, start + 1), (2, store.append(new))])
+    
+    restarted = SearchIndex(index_path=index_path)
+    asyncio.run(restarted.ensure_loaded(db))
+    image_id, score = restarted.search(new, 1)[0]
+    assert image_id == 2
+    assert score > 0.99
+    assert restarted.search(old, 1)[0][1] < 0.9